@@ -2,12 +2,18 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 import asyncio
 
+# The loop has to be in place before discord_client creates the client
+try:
+    import uvloop
+    loop = uvloop.new_event_loop()
+except ImportError:
+    loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
 import util.restart
 import plugins
 import discord_client
 
-loop = asyncio.get_event_loop()
-
 loop.create_task(discord_client.main_task())
 
 try:
@@ -14,11 +14,13 @@ import builtins
 import types
 import sys
 import atexit
+import collections
 import util.digraph
 
 plugins_namespace = "plugins"
+plugins_prefix = plugins_namespace + "."
 def is_plugin(name):
-    return name.startswith(plugins_namespace + ".")
+    return name.startswith(plugins_prefix)
 
 deps = util.digraph.Digraph()
 import_stack = []
@@ -35,13 +37,20 @@ def current_plugin():
         raise ValueError("not called during plugin initialization")
     return import_stack[-1]
 
+builtin_import = builtins.__import__
+
 def trace_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Imports made outside of plugin initialization aren't tracked
+    if not import_stack or not name.startswith(plugins_prefix):
+        return builtin_import(name, globals, locals, fromlist, level)
+    # Every prefix of the name past the namespace is itself a plugin
+    current = import_stack[-1]
     name_parts = name.split(".")
-    for i in range(1, len(name_parts) + 1):
-        parent = ".".join(name_parts[:i])
-        if is_plugin(parent):
-            deps.add_edge(current_plugin(), parent)
-    return builtins.__import__(name, globals, locals, fromlist, level)
+    parent = name_parts[0]
+    for part in name_parts[1:]:
+        parent += "." + part
+        deps.add_edge(current, parent)
+    return builtin_import(name, globals, locals, fromlist, level)
 
 trace_builtins = types.ModuleType(builtins.__name__)
 trace_builtins.__dict__.update(builtins.__dict__)
@@ -70,19 +79,28 @@ def finalizer(fin):
     finalizers[current].append(fin)
     return fin
 
+def raise_errors(message, errors):
+    """
+    Raise all of the collected exceptions together, if there were any. A lone
+    exception is reraised as is.
+    """
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise BaseExceptionGroup(message, errors)
+
 def finalize_module(name):
-    if name not in finalizers:
+    # Take the finalizers out first so that they are only ever run once
+    fins = finalizers.pop(name, None)
+    if not fins:
         return
-    gen = finalizers[name].__iter__()
-    def cont_finalizers():
+    errors = []
+    for fin in fins:
         try:
-            for fin in gen:
-                fin()
-        except:
-            cont_finalizers()
-            raise
-        del finalizers[name]
-    cont_finalizers()
+            fin()
+        except BaseException as exc:
+            errors.append(exc)
+    raise_errors("Exceptions while finalizing {}".format(name), errors)
 
 class PluginLoader(importlib.machinery.SourceFileLoader):
     __slots__ = ()
@@ -104,19 +122,20 @@ class PluginLoader(importlib.machinery.SourceFileLoader):
 class PluginFinder(importlib.machinery.PathFinder):
     __slots__ = ()
     @classmethod
-    def find_spec(self, name, path=None, target=None):
-        name_parts = name.split(".")
-        if not is_plugin(name):
-            return
+    def find_spec(cls, name, path=None, target=None):
+        if not name.startswith(plugins_prefix):
+            return None
         spec = super().find_spec(name, path, target)
         if spec == None:
-            return
+            return None
         spec.loader = PluginLoader(spec.loader.name, spec.loader.path)
         return spec
 
-for i in range(len(sys.meta_path)):
-    if sys.meta_path[i] == importlib.machinery.PathFinder:
-        sys.meta_path.insert(i, PluginFinder)
+try:
+    sys.meta_path.insert(sys.meta_path.index(importlib.machinery.PathFinder),
+        PluginFinder)
+except ValueError:
+    sys.meta_path.append(PluginFinder)
 
 def unsafe_unload(name):
     """
@@ -138,17 +157,18 @@ def unload(name):
     it. All finalizers will be executed even if some raise exceptions, if there
     were any they will all be reraised together.
     """
-    gen = deps.subgraph_paths_to(name).topo_sort_fwd()
-    def cont_unload():
-        try:
-            for dep in gen:
-                if dep != name:
-                    unsafe_unload(dep)
-        except:
-            cont_unload()
-            raise
+    errors = []
+    for dep in deps.topo_sort_paths_to(name):
+        if dep != name:
+            try:
+                unsafe_unload(dep)
+            except BaseException as exc:
+                errors.append(exc)
+    try:
         unsafe_unload(name)
-    cont_unload()
+    except BaseException as exc:
+        errors.append(exc)
+    raise_errors("Exceptions while unloading {}".format(name), errors)
 
 def unsafe_reload(name):
     """
@@ -180,41 +200,37 @@ def reload(name):
     the requested plugin if successful.
     """
     reloads = deps.subgraph_paths_to(name)
-    unload_success = set()
-    reload_success = set()
-    unload_gen = reloads.topo_sort_fwd()
-    reload_gen = reloads.topo_sort_bck()
-    def cont_reload():
-        try:
-            for dep in reload_gen:
-                if (dep in unload_success and
-                    all(m in reload_success for m in reloads.edges_from(dep))):
-                    importlib.import_module(dep)
-                    reload_success.add(dep)
-        except:
-            cont_reload()
-            raise
-    def cont_unload():
-        try:
-            for dep in unload_gen:
-                if dep != name:
-                    unsafe_unload(dep)
-                    unload_success.add(dep)
-        except:
-            cont_unload()
-            raise
-        try:
-            unsafe_unload(name)
-        except:
-            cont_reload()
-            raise
-        try:
-            ret = importlib.import_module(name)
-            reload_success.add(name)
-        finally:
-            cont_reload()
-        return ret
-    return cont_unload()
+    # For every successfully unloaded plugin, the number of its dependencies
+    # that have yet to be reloaded
+    pending = {}
+    errors = []
+    for dep in reloads.topo_sort_fwd():
+        if dep != name:
+            try:
+                unsafe_unload(dep)
+                pending[dep] = len(reloads.edges_from(dep))
+            except BaseException as exc:
+                errors.append(exc)
+    ret = None
+    reloaded = collections.deque()
+    try:
+        unsafe_unload(name)
+        ret = importlib.import_module(name)
+        reloaded.append(name)
+    except BaseException as exc:
+        errors.append(exc)
+    while reloaded:
+        for dep in reloads.edges_to(reloaded.popleft()):
+            if dep in pending:
+                pending[dep] -= 1
+                if pending[dep] == 0:
+                    try:
+                        importlib.import_module(dep)
+                        reloaded.append(dep)
+                    except BaseException as exc:
+                        errors.append(exc)
+    raise_errors("Exceptions while reloading {}".format(name), errors)
+    return ret
 
 def load(name):
     """
@@ -230,12 +246,10 @@ def load(name):
 
 @atexit.register
 def atexit_unload():
-    unload_gen = list(deps.topo_sort_fwd()).__iter__()
-    def cont_unload():
+    errors = []
+    for dep in list(deps.topo_sort_fwd()):
         try:
-            for dep in unload_gen:
-                unsafe_unload(dep)
-        except:
-            cont_unload()
-            raise
-    cont_unload()
+            unsafe_unload(dep)
+        except BaseException as exc:
+            errors.append(exc)
+    raise_errors("Exceptions while unloading plugins", errors)
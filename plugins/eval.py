@@ -1,15 +1,43 @@
 import io
 import ast
+import functools
 import builtins
 import inspect
 import sys
-import types
 import traceback
 import plugins.commands
 import plugins.privileges
 import util.discord
 import discord_client
 
+class ScopeBuiltins(dict):
+    """
+    Builtins for evaluated code: names that aren't real builtins are looked up
+    among the loaded modules at the time of use.
+    """
+    __slots__ = ()
+    def __missing__(self, key):
+        return sys.modules[key]
+
+# Using real builtins to avoid dependency tracking
+scope_builtins = ScopeBuiltins(builtins.__dict__)
+
+@functools.lru_cache(maxsize=256)
+def compile_code(source):
+    """
+    Compile a snippet as an expression if possible, or else as a series of
+    statements. Recently compiled snippets are cached by their source.
+    """
+    try:
+        return compile(source, "<eval>", "eval",
+            ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+    except SyntaxError:
+        return compile(source, "<eval>", "exec",
+            ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+
+code_arg_types = (plugins.commands.CodeBlockArg,
+    plugins.commands.InlineCodeArg)
+
 @plugins.commands.command("exec")
 @plugins.commands.command("eval")
 @plugins.privileges.priv("shell")
@@ -21,38 +49,25 @@ async def run_code(msg, args):
     The code also can use top-level "await".
     """
     outputs = []
-    code_scope = dict(sys.modules)
-    # Using real builtins to avoid dependency tracking
-    code_scope.update(builtins.__dict__)
-    code_scope["msg"] = msg
-    code_scope["client"] = discord_client.client
-    def mk_code_print(fp):
-        def code_print(*args, sep=" ", end="\n", file=fp, flush=False):
-            return print(*args, sep=sep, end=end, file=file, flush=flush)
-        return code_print
+    code_scope = {"__builtins__": scope_builtins,
+        "msg": msg, "client": discord_client.client}
+    blocks = [arg for arg in args if isinstance(arg, code_arg_types)]
     try:
-        for arg in args:
-            if (isinstance(arg, plugins.commands.CodeBlockArg)
-                or isinstance(arg, plugins.commands.InlineCodeArg)):
-                fp = io.StringIO()
-                outputs.append(fp)
-                code_scope["print"] = mk_code_print(fp)
-                try:
-                    code = compile(arg.text, "<msg {}>".format(msg.id),
-                        "eval", ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
-                except:
-                    code = compile(arg.text, "<msg {}>".format(msg.id),
-                        "exec", ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
-                fun = types.FunctionType(code, code_scope)
-                ret = fun()
-                if inspect.iscoroutine(ret):
-                    ret = await ret
-                if ret != None:
-                    mk_code_print(fp)(repr(ret))
+        for arg in blocks:
+            fp = io.StringIO()
+            outputs.append(fp)
+            code_scope["print"] = functools.partial(print, file=fp)
+            # A single namespace so that functions defined in the code can
+            # see its top-level names
+            ret = eval(compile_code(arg.text), code_scope)
+            if inspect.iscoroutine(ret):
+                ret = await ret
+            if ret != None:
+                print(repr(ret), file=fp)
     except:
         _, exc, tb = sys.exc_info()
-        mk_code_print(fp)("".join(traceback.format_tb(tb)))
-        mk_code_print(fp)(repr(exc))
+        print("".join(traceback.format_tb(tb)), file=fp)
+        print(repr(exc), file=fp)
         del tb
 
     def format_block(fp):
@@ -1,5 +1,4 @@
 import logging
-import discord.utils
 import util.db.kv
 import util.discord
 import plugins.commands
@@ -7,16 +6,29 @@ import plugins.commands
 logger = logging.getLogger(__name__)
 conf = util.db.kv.Config(__name__)
 
+# Cache of (user ids, role ids) for each priv, invalidated by set_priv
+priv_cache = {}
+
+def get_priv_ids(priv):
+    ids = priv_cache.get(priv)
+    if ids == None:
+        obj = conf[priv] or {}
+        ids = (frozenset(obj.get("users", ())), frozenset(obj.get("roles", ())))
+        priv_cache[priv] = ids
+    return ids
+
+def set_priv(priv, obj):
+    conf[priv] = obj
+    priv_cache.pop(priv, None)
+
 def has_privilege(priv, user_or_member):
-    obj = conf[priv]
-    if obj and "users" in obj:
-        if user_or_member.id in obj["users"]:
-            return True
-    if obj and "roles" in obj:
+    users, roles = get_priv_ids(priv)
+    if user_or_member.id in users:
+        return True
+    if roles:
         if hasattr(user_or_member, "roles"):
-            for role in user_or_member.roles:
-                if role.id in obj["roles"]:
-                    return True
+            if not roles.isdisjoint(role.id for role in user_or_member.roles):
+                return True
         # else we're in a DM or the user has left,
         # either way there's no roles to check
     return False
@@ -58,106 +70,129 @@ def role_id_from_arg(guild, arg):
                 util.discord.Inline(arg.text)))
     return role.id
 
-@plugins.commands.command("priv")
-@priv("shell")
-async def priv_command(msg, args):
-    cmd = args.next_arg()
-    if not isinstance(cmd, plugins.commands.StringArg): return
-
-    if cmd.text.lower() == "new":
-        priv = args.next_arg()
-        if not isinstance(priv, plugins.commands.StringArg): return
-        if conf[priv.text] != None:
-            return await msg.channel.send(
-                "Priv {} already exists".format(util.discord.Inline(priv.text)))
-        conf[priv.text] = {"users": [], "roles": []}
-        await msg.channel.send(
-            "Created priv {}".format(util.discord.Inline(priv.text)))
-
-    elif cmd.text.lower() == "delete":
-        priv = args.next_arg()
-        if not isinstance(priv, plugins.commands.StringArg): return
-        if conf[priv.text] == None:
-            return await msg.channel.send(
-                "Priv {} does not exist".format(util.discord.Inline(priv.text)))
-        conf[priv.text] = None
+async def priv_new(msg, args):
+    priv = args.next_arg()
+    if not isinstance(priv, plugins.commands.StringArg): return
+    if conf[priv.text] != None:
+        return await msg.channel.send(
+            "Priv {} already exists".format(util.discord.Inline(priv.text)))
+    set_priv(priv.text, {"users": [], "roles": []})
+    await msg.channel.send(
+        "Created priv {}".format(util.discord.Inline(priv.text)))
+
+async def priv_delete(msg, args):
+    priv = args.next_arg()
+    if not isinstance(priv, plugins.commands.StringArg): return
+    if conf[priv.text] == None:
+        return await msg.channel.send(
+            "Priv {} does not exist".format(util.discord.Inline(priv.text)))
+    set_priv(priv.text, None)
+    await msg.channel.send(
+        "Removed priv {}".format(util.discord.Inline(priv.text)))
+
+async def priv_show(msg, args):
+    priv = args.next_arg()
+    if not isinstance(priv, plugins.commands.StringArg): return
+    obj = conf[priv.text]
+    if obj == None:
         await msg.channel.send(
-            "Removed priv {}".format(util.discord.Inline(priv.text)))
-
-    elif cmd.text.lower() == "show":
-        priv = args.next_arg()
-        if not isinstance(priv, plugins.commands.StringArg): return
-        obj = conf[priv.text]
-        if obj == None:
-            await msg.channel.send(
-                "Priv {} does not exist".format(util.discord.Inline(priv.text)))
-        output = []
-        if "users" in obj:
-            for id in obj["users"]:
-                member = discord.utils.find(lambda m: m.id == id,
-                    msg.guild.members if msg.guild else ())
-                if member:
-                    member = "{}#{}({})".format(
-                        member.nick or member.name,
-                        member.discriminator, member.id)
-                else:
-                    member = "{}".format(id)
-                output.append("user {}".format(util.discord.Inline(member)))
-        if "roles" in obj:
-            for id in obj["roles"]:
-                role = discord.utils.find(lambda r: r.id == id,
-                    msg.guild.roles if msg.guild else ())
-                if role:
-                    role = "{}({})".format(role.name, role.id)
-                else:
-                    role = "{}".format(id)
-                output.append("role {}".format(util.discord.Inline(role)))
-        await msg.channel.send(
-            "Priv {} includes: {}".format(util.discord.Inline(priv.text),
-                "; ".join(output)))
-
-    elif cmd.text.lower() == "add":
-        priv = args.next_arg()
-        if not isinstance(priv, plugins.commands.StringArg): return
-        obj = conf[priv.text]
-        if obj == None:
-            await msg.channel.send(
-                "Priv {} does not exist".format(util.discord.Inline(priv.text)))
-        cmd = args.next_arg()
-        if not isinstance(cmd, plugins.commands.StringArg): return
-        if cmd.text.lower() == "user":
-            user_id = user_id_from_arg(msg.guild, args.next_arg())
-            if user_id == None: return
-            if user_id in obj.get("users", []):
-                return await msg.channel.send(
-                    "User {} is already in priv {}".format(user_id,
-                        util.discord.Inline(priv.text)))
-
-            obj = dict(obj)
-            obj["users"] = obj.get("users", []) + [user_id]
-            conf[priv.text] = obj
-
-            await msg.channel.send(
-                "Added user {} to priv {}".format(user_id,
-                    util.discord.Inline(priv.text)))
-
-        elif cmd.text.lower() == "role":
-            role_id = role_id_from_arg(msg.guild, args.next_arg())
-            if role_id == None: return
-            if role_id in obj.get("roles", []):
-                return await msg.channel.send(
-                    "Role {} is already in priv {}".format(role_id,
-                        util.discord.Inline(priv.text)))
-
-            obj = dict(obj)
-            obj["roles"] = obj.get("roles", []) + [role_id]
-            conf[priv.text] = obj
-
-            await msg.channel.send(
-                "Added role {} to priv {}".format(role_id,
-                    util.discord.Inline(priv.text)))
-
-    elif cmd.text.lower() == "remove":
+            "Priv {} does not exist".format(util.discord.Inline(priv.text)))
+    output = []
+    guild = msg.guild
+    if "users" in obj:
+        members_by_id = {m.id: m for m in (guild.members if guild else ())}
+        for id in obj["users"]:
+            member = members_by_id.get(id)
+            if member:
+                member = "{}#{}({})".format(
+                    member.nick or member.name,
+                    member.discriminator, member.id)
+            else:
+                member = "{}".format(id)
+            output.append("user {}".format(util.discord.Inline(member)))
+    if "roles" in obj:
+        roles_by_id = {r.id: r for r in (guild.roles if guild else ())}
+        for id in obj["roles"]:
+            role = roles_by_id.get(id)
+            if role:
+                role = "{}({})".format(role.name, role.id)
+            else:
+                role = "{}".format(id)
+            output.append("role {}".format(util.discord.Inline(role)))
+    await msg.channel.send(
+        "Priv {} includes: {}".format(util.discord.Inline(priv.text),
+            "; ".join(output)))
+
+async def priv_add_user(msg, args, priv, obj):
+    user_id = user_id_from_arg(msg.guild, args.next_arg())
+    if user_id == None: return
+    if user_id in obj.get("users", []):
+        return await msg.channel.send(
+            "User {} is already in priv {}".format(user_id,
+                util.discord.Inline(priv.text)))
+
+    users = list(obj.get("users", ()))
+    users.append(user_id)
+    set_priv(priv.text, {**obj, "users": users})
+
+    await msg.channel.send(
+        "Added user {} to priv {}".format(user_id,
+            util.discord.Inline(priv.text)))
+
+async def priv_add_role(msg, args, priv, obj):
+    role_id = role_id_from_arg(msg.guild, args.next_arg())
+    if role_id == None: return
+    if role_id in obj.get("roles", []):
+        return await msg.channel.send(
+            "Role {} is already in priv {}".format(role_id,
+                util.discord.Inline(priv.text)))
+
+    roles = list(obj.get("roles", ()))
+    roles.append(role_id)
+    set_priv(priv.text, {**obj, "roles": roles})
+
+    await msg.channel.send(
+        "Added role {} to priv {}".format(role_id,
+            util.discord.Inline(priv.text)))
+
+async def priv_remove_user(msg, args, priv, obj):
+    user_id = user_id_from_arg(msg.guild, args.next_arg())
+    if user_id == None: return
+    if user_id not in obj.get("users", []):
+        return await msg.channel.send(
+            "User {} is already not in priv {}".format(user_id,
+                util.discord.Inline(priv.text)))
+
+    obj = dict(obj)
+    obj["users"] = [i for i in obj.get("users", []) if i != user_id]
+    set_priv(priv.text, obj)
+
+    await msg.channel.send(
+        "Removed user {} from priv {}".format(user_id,
+            util.discord.Inline(priv.text)))
+
+async def priv_remove_role(msg, args, priv, obj):
+    role_id = role_id_from_arg(msg.guild, args.next_arg())
+    if role_id == None: return
+    if role_id not in obj.get("roles", []):
+        return await msg.channel.send(
+            "Role {} is already not in priv {}".format(role_id,
+                util.discord.Inline(priv.text)))
+
+    obj = dict(obj)
+    obj["roles"] = [i for i in obj.get("roles", []) if i != role_id]
+    set_priv(priv.text, obj)
+
+    await msg.channel.send(
+        "Removed role {} from priv {}".format(role_id,
+            util.discord.Inline(priv.text)))
+
+def priv_membership_command(subcommands):
+    """
+    Make a handler for "add"/"remove" that looks up the priv and then dispatches
+    on "user"/"role" to the given handlers.
+    """
+    async def handler(msg, args):
         priv = args.next_arg()
         if not isinstance(priv, plugins.commands.StringArg): return
         obj = conf[priv.text]
@@ -166,36 +201,25 @@ async def priv_command(msg, args):
                 "Priv {} does not exist".format(util.discord.Inline(priv.text)))
         cmd = args.next_arg()
         if not isinstance(cmd, plugins.commands.StringArg): return
-        if cmd.text.lower() == "user":
-            user_id = user_id_from_arg(msg.guild, args.next_arg())
-            if user_id == None: return
-            if user_id not in obj.get("users", []):
-                return await msg.channel.send(
-                    "User {} is already not in priv {}".format(user_id,
-                        util.discord.Inline(priv.text)))
-
-            obj = dict(obj)
-            obj["users"] = list(filter(lambda i: i != user_id,
-                obj.get("users", [])))
-            conf[priv.text] = obj
-
-            await msg.channel.send(
-                "Removed user {} from priv {}".format(user_id,
-                    util.discord.Inline(priv.text)))
-
-        elif cmd.text.lower() == "role":
-            role_id = role_id_from_arg(msg.guild, args.next_arg())
-            if role_id == None: return
-            if role_id not in obj.get("roles", []):
-                return await msg.channel.send(
-                    "Role {} is already not in priv {}".format(role_id,
-                        util.discord.Inline(priv.text)))
-
-            obj = dict(obj)
-            obj["roles"] = list(filter(lambda i: i != role_id,
-                obj.get("roles", [])))
-            conf[priv.text] = obj
+        subcommand = subcommands.get(cmd.text.lower())
+        if subcommand:
+            await subcommand(msg, args, priv, obj)
+    return handler
+
+priv_subcommands = {
+    "new": priv_new,
+    "delete": priv_delete,
+    "show": priv_show,
+    "add": priv_membership_command(
+        {"user": priv_add_user, "role": priv_add_role}),
+    "remove": priv_membership_command(
+        {"user": priv_remove_user, "role": priv_remove_role})}
 
-            await msg.channel.send(
-                "Removed role {} from priv {}".format(role_id,
-                    util.discord.Inline(priv.text)))
+@plugins.commands.command("priv")
+@priv("shell")
+async def priv_command(msg, args):
+    cmd = args.next_arg()
+    if not isinstance(cmd, plugins.commands.StringArg): return
+    subcommand = priv_subcommands.get(cmd.text.lower())
+    if subcommand:
+        await subcommand(msg, args)
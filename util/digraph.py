@@ -1,3 +1,5 @@
+import collections
+
 class Digraph:
     """A directed graph with no isolated vertices and no duplicate edges."""
 
@@ -5,25 +7,21 @@ class Digraph:
 
     def __init__(self):
         """Create an empty graph."""
-        self.fwd = {}
-        self.bck = {}
+        self.fwd = collections.defaultdict(set)
+        self.bck = collections.defaultdict(set)
 
     def add_edge(self, x, y):
         """Add an edge from x to y."""
-        if x not in self.fwd:
-            self.fwd[x] = set()
         self.fwd[x].add(y)
-        if y not in self.bck:
-            self.bck[y] = set()
         self.bck[y].add(x)
 
     def edges_to(self, x):
         """Return a (read-only) set of edges into x."""
-        return self.bck[x] if x in self.bck else set()
+        return self.bck.get(x, frozenset())
 
     def edges_from(self, x):
         """Return a (read-only) set of edges from x."""
-        return self.fwd[x] if x in self.fwd else set()
+        return self.fwd.get(x, frozenset())
 
     def subgraph_paths_to(self, x):
         """
@@ -31,16 +29,15 @@ class Digraph:
         via a path.
         """
         graph = Digraph()
-        seen = set()
-        def dfs(x):
-            if x in seen:
-                return
-            seen.add(x)
-            if x in self.bck:
-                for y in self.bck[x]:
-                    graph.add_edge(y, x)
-                    dfs(y)
-        dfs(x)
+        seen = {x}
+        stack = [x]
+        while stack:
+            x = stack.pop()
+            for y in self.bck.get(x, ()):
+                graph.add_edge(y, x)
+                if y not in seen:
+                    seen.add(y)
+                    stack.append(y)
         return graph
 
     def topo_sort_fwd(self):
@@ -48,53 +45,82 @@ class Digraph:
         Iterate through vertices in such a way that whenever there is an edge
         from x to y, x will come up earlier in iteration than y.
         """
-        seen = set()
-        def dfs(x):
-            if x in seen:
-                return
-            seen.add(x)
-            if x in self.bck:
-                for y in self.bck[x]:
-                    yield from dfs(y)
+        indeg = {x: len(self.bck.get(x, ()))
+            for x in self.fwd.keys() | self.bck.keys()}
+        queue = collections.deque(x for x, d in indeg.items() if d == 0)
+        while queue:
+            x = queue.popleft()
             yield x
-        for x in self.fwd:
-            yield from dfs(x)
-        for x in self.bck:
-            yield from dfs(x)
+            for y in self.fwd.get(x, ()):
+                indeg[y] -= 1
+                if indeg[y] == 0:
+                    queue.append(y)
+        # Vertices on (or behind) a cycle never reach zero, emit them anyway
+        for x, d in indeg.items():
+            if d > 0:
+                yield x
 
     def topo_sort_bck(self):
         """
         Iterate through vertices in such a way that whenever there is an edge
         from x to y, x will come up later in iteration than y.
         """
-        seen = set()
-        def dfs(x):
-            if x in seen:
-                return
-            seen.add(x)
-            if x in self.fwd:
-                for y in self.fwd[x]:
-                    yield from dfs(y)
+        outdeg = {x: len(self.fwd.get(x, ()))
+            for x in self.fwd.keys() | self.bck.keys()}
+        queue = collections.deque(x for x, d in outdeg.items() if d == 0)
+        while queue:
+            x = queue.popleft()
             yield x
-        for x in self.bck:
-            yield from dfs(x)
-        for x in self.fwd:
-            yield from dfs(x)
+            for y in self.bck.get(x, ()):
+                outdeg[y] -= 1
+                if outdeg[y] == 0:
+                    queue.append(y)
+        # Vertices on (or ahead of) a cycle never reach zero, emit them anyway
+        for x, d in outdeg.items():
+            if d > 0:
+                yield x
+
+    def topo_sort_paths_to(self, x):
+        """
+        Iterate through x and the vertices that can reach x via a path, in such
+        a way that whenever there is an edge from y to z, y will come up earlier
+        in iteration than z. This is like subgraph_paths_to(x).topo_sort_fwd()
+        without building the subgraph. Edges from a vertex may be deleted as
+        soon as it comes up in iteration.
+        """
+        indeg = {x: len(self.bck.get(x, ()))}
+        stack = [x]
+        while stack:
+            y = stack.pop()
+            for z in self.bck.get(y, ()):
+                if z not in indeg:
+                    # Everything with an edge into z can reach x as well
+                    indeg[z] = len(self.bck.get(z, ()))
+                    stack.append(z)
+        queue = collections.deque(y for y, d in indeg.items() if d == 0)
+        while queue:
+            y = queue.popleft()
+            for z in self.fwd.get(y, ()):
+                if z in indeg:
+                    indeg[z] -= 1
+                    if indeg[z] == 0:
+                        queue.append(z)
+            yield y
+        # Vertices on (or behind) a cycle never reach zero, emit them anyway
+        for y, d in indeg.items():
+            if d > 0:
+                yield y
 
     def del_edges_from(self, x):
         """
         Delete all edges from x.
         """
-        if x in self.fwd:
-            for y in self.fwd[x]:
-                self.bck[y].discard(x)
-            del self.fwd[x]
+        for y in self.fwd.pop(x, ()):
+            self.bck[y].discard(x)
 
     def del_edges_to(self, x):
         """
         Delete all edges into x.
         """
-        if x in self.bck:
-            for y in self.bck[x]:
-                self.fwd[y].discard(x)
-            del self.bck[x]
+        for y in self.bck.pop(x, ()):
+            self.fwd[y].discard(x)